@@ -3,11 +3,16 @@ import re
 import asyncio
 import aiosqlite
 import logging
-from datetime import datetime
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass
+from time import time_ns
 from random import randint
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
 from aiogram.types import Message
+from aiogram.utils.formatting import Code, Text
+from aiosqlitepool import SQLiteConnectionPool
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,65 +22,297 @@ logging.basicConfig(
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB = os.getenv("DB_PATH", "quizbot.db")
 
-CREATE_TEST_RE = re.compile(r"^\s*(\d+)[^\S\r\n]*(?:тест:|:|\s+)?\s*\+([a-dA-D]+)\s*$", re.IGNORECASE)
-SUBMIT_RE = re.compile(r"^\s*(\d{4,6})\s*:\s*([a-dA-D]+)\s*$")
+# "10 тест: +abcd..." creates a test, "1596:abcd..." submits answers
+TEST_MESSAGE_RE = re.compile(
+    r"^\s*(?:(?P<n>\d+)[^\S\r\n]*(?:тест:|:|\s+)?\s*\+(?P<key>[a-d]+)"
+    r"|(?P<code>\d{4,6})\s*:\s*(?P<answers>[a-d]+))\s*$",
+    re.IGNORECASE,
+)
+
+# Kept as module constants so pooled connections reuse their cached prepared statements
+SQL_GET_ROLE = "SELECT role FROM users WHERE user_id = ?"
+SQL_SET_ROLE = """
+    INSERT INTO users(user_id, role, created_at)
+    VALUES(?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET role=excluded.role
+"""
+SQL_GET_TEST = "SELECT owner_id, answer_key, length, is_open FROM tests WHERE code = ?"
+SQL_INSERT_TEST = """
+    INSERT OR IGNORE INTO tests(code, owner_id, answer_key, length, is_open, created_at)
+    VALUES(?, ?, ?, ?, 1, ?)
+"""
+SQL_CLOSE_TEST = "UPDATE tests SET is_open = 0 WHERE code = ?"
+SQL_INSERT_SUBMISSION = """
+    INSERT INTO submissions(test_code, user_id, answers, score, submitted_at)
+    SELECT ?, ?, ?, ?, ?
+    WHERE EXISTS (SELECT 1 FROM tests WHERE code = ? AND is_open = 1)
+"""
+SQL_FINISH_LEADERBOARD = """
+    SELECT user_id, answers, score
+    FROM submissions
+    WHERE test_code = ?
+    ORDER BY score DESC, submitted_at ASC
+    LIMIT 10
+"""
+SQL_RESULTS_LEADERBOARD = """
+    SELECT user_id, score, submitted_at
+    FROM submissions
+    WHERE test_code = ?
+    ORDER BY score DESC, submitted_at ASC
+    LIMIT 15
+"""
+
+# Fixed replies are rendered to (text, entities) once instead of sending Markdown every time
+START_MESSAGE = Text(
+    "Привет! Я тест-бот.\n\n"
+    "Выберите роль:\n"
+    "• /register author — я составитель тестов\n"
+    "• /register participant — я участник\n\n"
+    "Примеры:\n"
+    "Создание теста (составитель):  ", Code("10 тест: +abcdabcdab"), "\n"
+    "Сдача ответов (участник):       ", Code("1596:abcdabcdab"), "\n"
+    "Завершить тест (составитель):   ", Code("/finish 1596"),
+).as_kwargs()
+HELP_MESSAGE = Text(
+    "Не понял сообщение.\n\n"
+    "Создать тест (составитель):  ", Code("10 тест: +abcdabcdab"), "\n"
+    "Сдать ответы (участник):     ", Code("1596:abcdabcdab"), "\n"
+    "Завершить тест:              ", Code("/finish 1596"), "\n"
+    "Роли: /register author  или  /register participant",
+).as_kwargs()
+
+# Static rejection replies, formatted only when they carry numbers
+_MSGS = {
+    "register_usage": "Используйте: /register author  или  /register participant",
+    "not_author": "Команда доступна только составителю.",
+    "finish_usage": "Используйте: /finish <код_теста>",
+    "test_not_found": "Тест с таким кодом не найден.",
+    "not_owner": "Вы не являетесь владельцем этого теста.",
+    "already_finished": "Тест уже завершён.",
+    "create_not_author": "Создавать тесты может только составитель. Зарегистрируйтесь: /register author",
+    "key_length": "Длина ключа ({got}) должна совпадать с количеством вопросов ({n}).",
+    "no_free_code": "Не удалось подобрать свободный код теста. Попробуйте ещё раз.",
+    "test_closed": "Тест уже завершён. Новые ответы не принимаются.",
+    "answers_length": "Длина ваших ответов ({got}) должна быть {n}.",
+    "already_submitted": "Вы уже отправили ответы на этот тест. Повторная попытка не разрешена.",
+    "results_usage": "Используйте: /results <код_теста>",
+    "results_not_found": "Тест не найден.",
+}
+
+readers: SQLiteConnectionPool | None = None
+writer: aiosqlite.Connection | None = None
+writer_lock = asyncio.Lock()
+
+SUBMIT_BATCH_SIZE = 50
+SUBMIT_BATCH_WINDOW = 0.005
+_submit_q: asyncio.Queue[tuple[tuple, asyncio.Future]] = asyncio.Queue()
+
+ROLE_CACHE_SIZE = 10_000
+_role_cache: OrderedDict[int, str] = OrderedDict()
+
+@dataclass(slots=True)
+class TestRec:
+    owner_id: int
+    answer_key: str
+    length: int
+    is_open: bool
+
+_test_cache: dict[str, TestRec] = {}
+
+class TestClosedError(Exception):
+    pass
+
+async def _connect(*pragmas: str) -> aiosqlite.Connection:
+    db = await aiosqlite.connect(DB)
+    for pragma in ("journal_mode=WAL", "synchronous=NORMAL", "busy_timeout=5000",
+                   "temp_store=MEMORY", "cache_size=-20000", *pragmas):
+        await db.execute(f"PRAGMA {pragma}")
+    return db
+
+async def _connect_reader() -> aiosqlite.Connection:
+    return await _connect("query_only=1")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    role TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    code TEXT UNIQUE NOT NULL,
+    owner_id INTEGER NOT NULL,
+    answer_key TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    is_open INTEGER NOT NULL DEFAULT 1,
+    created_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    test_code TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    answers TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    submitted_at INTEGER NOT NULL,
+    UNIQUE(test_code, user_id)
+);
+CREATE INDEX IF NOT EXISTS ix_sub_leaderboard
+    ON submissions(test_code, score DESC, submitted_at ASC);
+"""
+
+# Databases created before timestamps became epoch nanoseconds declare these columns
+# as TEXT, which would coerce time_ns() values back into strings.
+_TIMESTAMP_COLUMNS = {
+    "users": ("created_at", "user_id, role"),
+    "tests": ("created_at", "id, code, owner_id, answer_key, length, is_open"),
+    "submissions": ("submitted_at", "id, test_code, user_id, answers, score"),
+}
+
+def _to_epoch_ns(column: str) -> str:
+    # integers stored as text pass through; ISO strings go through julianday (ms precision)
+    return (
+        f"CASE WHEN typeof({column}) = 'integer' OR {column} NOT GLOB '*[^0-9]*' "
+        f"THEN CAST({column} AS INTEGER) "
+        f"ELSE COALESCE(CAST(round((julianday({column}) - 2440587.5) * 86400000) AS INTEGER) * 1000000, 0) END"
+    )
+
+async def _text_timestamp_tables(db: aiosqlite.Connection) -> list[str]:
+    legacy = []
+    for table, (column, _) in _TIMESTAMP_COLUMNS.items():
+        cur = await db.execute(f"PRAGMA table_info({table})")
+        for _, name, decl_type, *_ in await cur.fetchall():
+            if name == column and decl_type.upper() == "TEXT":
+                legacy.append(table)
+    return legacy
 
 async def init_db():
     async with aiosqlite.connect(DB) as db:
-        await db.executescript("""
-        PRAGMA journal_mode=WAL;
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            role TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS tests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT UNIQUE NOT NULL,
-            owner_id INTEGER NOT NULL,
-            answer_key TEXT NOT NULL,
-            length INTEGER NOT NULL,
-            is_open INTEGER NOT NULL DEFAULT 1,
-            created_at TEXT NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS submissions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            test_code TEXT NOT NULL,
-            user_id INTEGER NOT NULL,
-            answers TEXT NOT NULL,
-            score INTEGER NOT NULL,
-            submitted_at TEXT NOT NULL,
-            UNIQUE(test_code, user_id)
-        );
-        """)
-        await db.commit()
+        await db.execute("PRAGMA journal_mode=WAL")
+        legacy = await _text_timestamp_tables(db)
+        if not legacy:
+            await db.executescript(SCHEMA)
+            await db.commit()
+            return
+
+        logging.info("Migrating timestamps to epoch nanoseconds: %s", ", ".join(legacy))
+        script = ["BEGIN;"]
+        script += [f"ALTER TABLE {t} RENAME TO {t}_legacy;" for t in legacy]
+        script.append(SCHEMA)
+        for t in legacy:
+            column, rest = _TIMESTAMP_COLUMNS[t]
+            script.append(
+                f"INSERT INTO {t}({rest}, {column}) "
+                f"SELECT {rest}, {_to_epoch_ns(column)} FROM {t}_legacy;"
+            )
+            script.append(f"DROP TABLE {t}_legacy;")
+        script.append("COMMIT;")
+        await db.executescript("\n".join(script))
+
+def _remember_role(user_id: int, role: str):
+    _role_cache[user_id] = role
+    _role_cache.move_to_end(user_id)
+    if len(_role_cache) > ROLE_CACHE_SIZE:
+        _role_cache.popitem(last=False)
 
 async def get_role(user_id: int) -> str | None:
-    async with aiosqlite.connect(DB) as db:
-        cur = await db.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
+    role = _role_cache.get(user_id)
+    if role is not None:
+        _role_cache.move_to_end(user_id)
+        return role
+    async with readers.connection() as db:
+        cur = await db.execute(SQL_GET_ROLE, (user_id,))
         row = await cur.fetchone()
-        return row[0] if row else None
+    if not row:
+        return None
+    # set_role may have cached a newer role while we were reading
+    if user_id not in _role_cache:
+        _remember_role(user_id, row[0])
+    return _role_cache[user_id]
 
 async def set_role(user_id: int, role: str):
-    now = datetime.utcnow().isoformat()
-    async with aiosqlite.connect(DB) as db:
-        await db.execute("""
-            INSERT INTO users(user_id, role, created_at)
-            VALUES(?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET role=excluded.role
-        """, (user_id, role, now))
-        await db.commit()
-
-async def generate_unique_code() -> str:
-    async with aiosqlite.connect(DB) as db:
-        while True:
-            code = f"{randint(1000, 9999)}"
-            cur = await db.execute("SELECT 1 FROM tests WHERE code = ?", (code,))
-            if not await cur.fetchone():
-                return code
+    now = time_ns()
+    async with writer_lock:
+        try:
+            await writer.execute(SQL_SET_ROLE, (user_id, role, now))
+            await writer.commit()
+        except BaseException:
+            await writer.rollback()
+            raise
+    _remember_role(user_id, role)
+
+async def get_test(code: str) -> TestRec | None:
+    rec = _test_cache.get(code)
+    if rec is not None:
+        return rec
+    async with readers.connection() as db:
+        cur = await db.execute(SQL_GET_TEST, (code,))
+        row = await cur.fetchone()
+    if not row:
+        return None
+    owner_id, answer_key, length, is_open = row
+    return _test_cache.setdefault(code, TestRec(owner_id, answer_key, length, bool(is_open)))
+
+async def _write_submissions(batch: list[tuple[tuple, asyncio.Future]]):
+    results = []
+    async with writer_lock:
+        try:
+            await writer.execute("BEGIN")
+            for params, fut in batch:
+                # a UNIQUE violation aborts only its own statement, not the batch
+                try:
+                    # the test may have been closed after handle_submit checked the cache
+                    cur = await writer.execute(SQL_INSERT_SUBMISSION, (*params, params[0]))
+                    results.append((fut, None if cur.rowcount else TestClosedError(params[0])))
+                except aiosqlite.IntegrityError as e:
+                    results.append((fut, e))
+            await writer.commit()
+        except BaseException as e:
+            await writer.rollback()
+            if not isinstance(e, Exception):
+                raise
+            results = [(fut, e) for _, fut in batch]
+    for fut, exc in results:
+        if fut.done():
+            continue
+        if exc is None:
+            fut.set_result(None)
+        else:
+            fut.set_exception(exc)
+
+def _cancel_pending(batch: list[tuple[tuple, asyncio.Future]]):
+    for _, fut in batch:
+        if not fut.done():
+            fut.cancel()
+
+async def submission_writer():
+    while True:
+        batch = [await _submit_q.get()]
+        try:
+            await asyncio.sleep(SUBMIT_BATCH_WINDOW)
+            while len(batch) < SUBMIT_BATCH_SIZE and not _submit_q.empty():
+                batch.append(_submit_q.get_nowait())
+            await _write_submissions(batch)
+        except BaseException:
+            _cancel_pending(batch)
+            raise
+
+async def submit(params: tuple):
+    fut = asyncio.get_running_loop().create_future()
+    await _submit_q.put((params, fut))
+    await fut
+
+async def reply(m: Message, key: str, **fmt):
+    text = _MSGS[key]
+    await m.answer(text.format(**fmt) if fmt else text)
 
 def score_answers(key: str, ans: str) -> int:
-    return sum(1 for k, a in zip(key, ans) if k == a)
+    # XOR both strings as big integers: matching positions become zero bytes
+    n = min(len(key), len(ans))
+    diff = int.from_bytes(key[:n].encode("ascii"), "big") ^ int.from_bytes(ans[:n].encode("ascii"), "big")
+    return diff.to_bytes(n, "big").count(0)
+
+def starts_with_digit(text: str | None) -> bool:
+    return bool(text) and text.lstrip()[:1].isdigit()
 
 def norm(s: str) -> str:
     return s.strip().lower()
@@ -84,29 +321,23 @@ async def main():
     if not BOT_TOKEN:
         raise SystemExit("Установите переменную окружения BOT_TOKEN")
 
+    global readers, writer
     await init_db()
+    writer = await _connect("wal_autocheckpoint=1000")
+    readers = SQLiteConnectionPool(_connect_reader, pool_size=4)
+    writer_task = asyncio.create_task(submission_writer())
     bot = Bot(BOT_TOKEN)
     dp = Dispatcher()
 
     @dp.message(Command("start"))
     async def cmd_start(m: Message):
-        await m.answer(
-            "Привет! Я тест-бот.\n\n"
-            "Выберите роль:\n"
-            "• /register author — я составитель тестов\n"
-            "• /register participant — я участник\n\n"
-            "Примеры:\n"
-            "Создание теста (составитель):  `10 тест: +abcdabcdab`\n"
-            "Сдача ответов (участник):       `1596:abcdabcdab`\n"
-            "Завершить тест (составитель):   `/finish 1596`",
-            parse_mode="Markdown"
-        )
+        await m.answer(**START_MESSAGE)
 
     @dp.message(Command("register"))
     async def cmd_register(m: Message):
         parts = m.text.split()
         if len(parts) < 2 or parts[1] not in ("author", "participant"):
-            await m.answer("Используйте: /register author  или  /register participant")
+            await reply(m, "register_usage")
             return
         await set_role(m.from_user.id, parts[1])
         await m.answer(f"Роль установлена: {parts[1]} ✅")
@@ -115,71 +346,75 @@ async def main():
     async def cmd_finish(m: Message):
         role = await get_role(m.from_user.id)
         if role != "author":
-            await m.answer("Команда доступна только составителю.")
+            await reply(m, "not_author")
             return
         parts = m.text.split()
         if len(parts) < 2 or not parts[1].isdigit():
-            await m.answer("Используйте: /finish <код_теста>")
+            await reply(m, "finish_usage")
             return
         code = parts[1]
-        async with aiosqlite.connect(DB) as db:
-            cur = await db.execute("SELECT owner_id, is_open, answer_key FROM tests WHERE code = ?", (code,))
-            row = await cur.fetchone()
-            if not row:
-                await m.answer("Тест с таким кодом не найден.")
-                return
-            owner_id, is_open, answer_key = row
-            if owner_id != m.from_user.id:
-                await m.answer("Вы не являетесь владельцем этого теста.")
-                return
-            if not is_open:
-                await m.answer("Тест уже завершён.")
-                return
-
-            await db.execute("UPDATE tests SET is_open = 0 WHERE code = ?", (code,))
-            cur = await db.execute("""
-                SELECT user_id, answers, score
-                FROM submissions
-                WHERE test_code = ?
-                ORDER BY score DESC, submitted_at ASC
-            """, (code,))
-            rows = await cur.fetchall()
-            await db.commit()
+        rec = await get_test(code)
+        if not rec:
+            await reply(m, "test_not_found")
+            return
+        if rec.owner_id != m.from_user.id:
+            await reply(m, "not_owner")
+            return
+        if not rec.is_open:
+            await reply(m, "already_finished")
+            return
+
+        async with writer_lock:
+            try:
+                await writer.execute("BEGIN IMMEDIATE")
+                await writer.execute(SQL_CLOSE_TEST, (code,))
+                cur = await writer.execute(SQL_FINISH_LEADERBOARD, (code,))
+                rows = await cur.fetchall()
+                await writer.commit()
+            except BaseException:
+                await writer.rollback()
+                raise
+        rec.is_open = False
 
         if not rows:
             await m.answer(f"Тест {code} закрыт. Участников не было.")
             return
 
         lines = [f"Тест {code} закрыт. Результаты:"]
-        for i, (uid, ans, sc) in enumerate(rows[:10], 1):
-            lines.append(f"{i}. user {uid}: {sc}/{len(answer_key)}")
+        for i, (uid, ans, sc) in enumerate(rows, 1):
+            lines.append(f"{i}. user {uid}: {sc}/{rec.length}")
         await m.answer("\n".join(lines))
 
-    @dp.message(F.text.regexp(CREATE_TEST_RE))
-    async def handle_create(m: Message, regexp):
+    async def handle_create(m: Message, n_str: str, key_raw: str):
         role = await get_role(m.from_user.id)
         if role != "author":
-            await m.answer("Создавать тесты может только составитель. Зарегистрируйтесь: /register author")
+            await reply(m, "create_not_author")
             return
 
-        n_str, key_raw = regexp.group(1), regexp.group(2)
         n = int(n_str)
         key = norm(key_raw)
-        if not all(c in "abcd" for c in key):
-            await m.answer("Ключ должен содержать только буквы a/b/c/d (после знака '+').")
-            return
         if len(key) != n:
-            await m.answer(f"Длина ключа ({len(key)}) должна совпадать с количеством вопросов ({n}).")
+            await reply(m, "key_length", got=len(key), n=n)
             return
 
-        code = await generate_unique_code()
-        now = datetime.utcnow().isoformat()
-        async with aiosqlite.connect(DB) as db:
-            await db.execute("""
-                INSERT INTO tests(code, owner_id, answer_key, length, is_open, created_at)
-                VALUES(?, ?, ?, ?, 1, ?)
-            """, (code, m.from_user.id, key, n, now))
-            await db.commit()
+        now = time_ns()
+        async with writer_lock:
+            try:
+                for _ in range(8):
+                    code = f"{randint(1000, 9999)}"
+                    cur = await writer.execute(SQL_INSERT_TEST, (code, m.from_user.id, key, n, now))
+                    if cur.rowcount:
+                        break
+                else:
+                    code = None
+                await writer.commit()
+            except BaseException:
+                await writer.rollback()
+                raise
+        if code is None:
+            await reply(m, "no_free_code")
+            return
+        _test_cache[code] = TestRec(m.from_user.id, key, n, True)
 
         await m.answer(
             "✅ Тест создан!\n\n"
@@ -192,87 +427,81 @@ async def main():
             parse_mode="Markdown"
         )
 
-    @dp.message(F.text.regexp(SUBMIT_RE))
-    async def handle_submit(m: Message, regexp):
-        code, ans_raw = regexp.group(1), regexp.group(2)
+    async def handle_submit(m: Message, code: str, ans_raw: str):
         answers = norm(ans_raw)
-        if not all(c in "abcd" for c in answers):
-            await m.answer("Ответы должны состоять только из a/b/c/d.")
+        rec = await get_test(code)
+        if not rec:
+            await reply(m, "test_not_found")
+            return
+        if not rec.is_open:
+            await reply(m, "test_closed")
+            return
+        if len(answers) != rec.length:
+            await reply(m, "answers_length", got=len(answers), n=rec.length)
             return
 
-        async with aiosqlite.connect(DB) as db:
-            cur = await db.execute("SELECT answer_key, is_open FROM tests WHERE code = ?", (code,))
-            row = await cur.fetchone()
-            if not row:
-                await m.answer("Тест с таким кодом не найден.")
-                return
-            key, is_open = row
-            if not is_open:
-                await m.answer("Тест уже завершён. Новые ответы не принимаются.")
-                return
-            if len(answers) != len(key):
-                await m.answer(f"Длина ваших ответов ({len(answers)}) должна быть {len(key)}.")
-                return
-
-            sc = score_answers(key, answers)
-            now = datetime.utcnow().isoformat()
-            try:
-                await db.execute("""
-                    INSERT INTO submissions(test_code, user_id, answers, score, submitted_at)
-                    VALUES(?, ?, ?, ?, ?)
-                """, (code, m.from_user.id, answers, sc, now))
-                await db.commit()
-            except aiosqlite.IntegrityError:
-                await m.answer("Вы уже отправили ответы на этот тест. Повторная попытка не разрешена.")
-                return
+        sc = score_answers(rec.answer_key, answers)
+        now = time_ns()
+        try:
+            await submit((code, m.from_user.id, answers, sc, now))
+        except aiosqlite.IntegrityError:
+            await reply(m, "already_submitted")
+            return
+        except TestClosedError:
+            rec.is_open = False
+            await reply(m, "test_closed")
+            return
+
+        await m.answer(f"Принято! Ваш результат: {sc}/{rec.length} ✅")
 
-        await m.answer(f"Принято! Ваш результат: {sc}/{len(answers)} ✅")
+    # cheap prefix check first so ordinary chatter never reaches the regex
+    @dp.message(F.text.func(starts_with_digit), F.text.regexp(TEST_MESSAGE_RE).as_("match"))
+    async def handle_test_message(m: Message, match: re.Match):
+        if match["key"] is not None:
+            await handle_create(m, match["n"], match["key"])
+        else:
+            await handle_submit(m, match["code"], match["answers"])
 
     @dp.message(Command("results"))
     async def cmd_results(m: Message):
         parts = m.text.split()
         if len(parts) < 2:
-            await m.answer("Используйте: /results <код_теста>")
+            await reply(m, "results_usage")
             return
         code = parts[1]
-        async with aiosqlite.connect(DB) as db:
-            cur = await db.execute("SELECT answer_key, owner_id, is_open FROM tests WHERE code = ?", (code,))
-            row = await cur.fetchone()
-            if not row:
-                await m.answer("Тест не найден.")
-                return
-            key, owner_id, is_open = row
-            cur = await db.execute("""
-                SELECT user_id, score, submitted_at
-                FROM submissions
-                WHERE test_code = ?
-                ORDER BY score DESC, submitted_at ASC
-            """, (code,))
+        rec = await get_test(code)
+        if not rec:
+            await reply(m, "results_not_found")
+            return
+        async with readers.connection() as db:
+            cur = await db.execute(SQL_RESULTS_LEADERBOARD, (code,))
             rows = await cur.fetchall()
 
-        status = "открыт" if is_open else "закрыт"
+        status = "открыт" if rec.is_open else "закрыт"
         if not rows:
             await m.answer(f"Тест {code} ({status}). Пока без попыток.")
             return
 
         lines = [f"Тест {code} ({status}). Итоги:"]
-        for i, (uid, sc, ts) in enumerate(rows[:15], 1):
-            lines.append(f"{i}. user {uid}: {sc}/{len(key)}")
+        for i, (uid, sc, ts) in enumerate(rows, 1):
+            lines.append(f"{i}. user {uid}: {sc}/{rec.length}")
         await m.answer("\n".join(lines))
 
     @dp.message()
     async def fallback(m: Message):
-        await m.answer(
-            "Не понял сообщение.\n\n"
-            "Создать тест (составитель):  `10 тест: +abcdabcdab`\n"
-            "Сдать ответы (участник):     `1596:abcdabcdab`\n"
-            "Завершить тест:              `/finish 1596`\n"
-            "Роли: /register author  или  /register participant",
-            parse_mode="Markdown"
-        )
+        await m.answer(**HELP_MESSAGE)
 
     logging.info("Bot is running…")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        writer_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await writer_task
+        while not _submit_q.empty():
+            _cancel_pending([_submit_q.get_nowait()])
+        await readers.close()
+        await writer.close()
 
 if __name__ == "__main__":
     try: